@@ -1,5 +1,6 @@
 from .clex import (
     clex,
-    split
+    split,
+    split_bytes
 )
 
@@ -1,9 +1,8 @@
 # Filename: clex.py
 # Description: Simple lexical analasys for programming syntax
 
-import io
+import re
 import sys
-import six
 
 
 # Exceptions
@@ -23,21 +22,44 @@ class UnexpectedEOLError(Exception):
         self.eol = eol
 
 
+# Caches
+
+
+# Lexer tables by configuration, see `clex._prepare`
+# Cleared once it holds `_MAXTABLES` configurations, so it can't grow without bound
+_tables = {}
+_MAXTABLES = 64
+
+
 # Classes
 
 
 class clex(object):
     """
     Simple lexical analasys for programming syntax.
+    Configuration attributes may be changed after construction, up until the first token is read.
     """
 
-    def __init__(self, instream):
+    def __init__(self, instream, bufsize=None):
         """
         Initialize with input stream or string.
+        Streams are read in full up front and lexed from an in-memory buffer.
+        If `bufsize` is given, streams are instead read `bufsize` characters at a time, to lex inputs too large to hold in memory.
         """
-        if isinstance(instream, six.string_types):
-            instream = io.StringIO(six.text_type(instream))
-        self._instream = instream
+        self._stream = None
+        if isinstance(instream, str):
+            self._buf = instream
+        elif bufsize is None:
+            self._buf = instream.read()
+        elif bufsize <= 0:
+            raise ValueError('bufsize must be positive')
+        else:
+            self._stream = instream
+            self._bufsize = bufsize
+            self._buf = instream.read(bufsize)
+        self._pos = 0
+        self._len = len(self._buf)
+        self._prepared = False
         self._tokenstack = []
         
         self.escape = '\\'
@@ -57,8 +79,6 @@ class clex(object):
 
         self.debug = 0
         self.logger = sys.stdout.write
-        
-        self._oops = []
     
     def get_token(self):
         """
@@ -73,54 +93,61 @@ class clex(object):
         """
         Reads a token from input.
         """
+        if not self._prepared:
+            self._prepare()
+
         # Skip whitespaces and comments
         while True:
-            token = self._readone()
-            
-            if token == '':
+            buf = self._buf
+            pos = self._skip_re.match(buf, self._pos).end()
+            if pos >= self._len:
+                self._pos = pos
+                if self._fill(pos):
+                    continue
                 return self.eof
+            token = buf[pos]
+            self._pos = pos = pos + 1
 
             # Skip whitespaces
-            ntoken = self._findtokens(token, self.whitespace)
-            if ntoken is not None:
+            if token in self._ws:
                 continue
 
-            # Skip oneline comments
-            ntoken = self._findtokens(token, self.oneline_commenters)
-            if ntoken is not None:
-                self._consumeuntil('\n', allow_eof=True, allow_eol=True)
-                continue
+            # Comments left over by `_skip_re` are rare, only try them on a possible first character
+            if token in self._commentstart:
+                # Skip oneline comments
+                ntoken = self._findtokens(token, self._oneline_trie)
+                if ntoken is not None:
+                    self._consumeuntil('\n', allow_eof=True, allow_eol=True)
+                    continue
+
+                # Skip multiline comments
+                ntoken = self._findtokens(token, self._multiline_trie)
+                if ntoken is not None:
+                    self._consumeuntil(self._multiline_closers[ntoken], allow_eof=True, allow_eol=True)
+                    continue
+
+                # Looking ahead may have read more input into the buffer
+                buf = self._buf
+                pos = self._pos
 
-            # Skip multiline comments
-            ntoken = self._findtokens(token, [x[0] for x in self.multiline_commenters])
-            if ntoken is not None:
-                self._consumeuntil([x[1] for x in self.multiline_commenters if x[0] == ntoken][0], allow_eof=True, allow_eol=True)
-                continue
-            
             # Find strings
-            ntoken = self._findtokens(token, self.quotes)
-            if ntoken is not None:
-                return self._consumestring(ntoken)
+            if token in self._quotes:
+                return self._consumestring(token)
 
             # Find keywords
-            if token in self.tokenchars[0]:
-                while True:
-                    ntoken = self._readone()
-                    if not len(ntoken) or (ntoken not in self.tokenchars[0] and ntoken not in self.tokenchars[1]):
-                        self._oops.append(ntoken)
-                        return token
-                    token = token + ntoken
+            # Keywords and numbers repeat a lot, so they are interned to share one string per distinct token
+            if token in self._idstart:
+                self._pos = self._idcont_re.match(buf, pos).end()
+                if self._pos >= self._len:
+                    return sys.intern(self._extendrun(pos - 1, self._idcont_re))
+                return sys.intern(buf[pos - 1:self._pos])
 
             # Find numbers
-            if token in self.numchars[0] or token in self.numchars[2]:
-                while True:
-                    ntoken = self._readone()
-                    if not len(ntoken) or (ntoken not in self.numchars[0] and ntoken not in self.numchars[1]):
-                        self._oops.append(ntoken)
-                        return token
-                    if ntoken in self.numchars[1] and ntoken in token:
-                        raise UnexpectedToken(ntoken)
-                    token = token + ntoken
+            if token in self._numstart:
+                self._pos = self._numcont_re.match(buf, pos).end()
+                if self._pos >= self._len:
+                    return sys.intern(self._checknumber(self._extendrun(pos - 1, self._numcont_re), self._numonce))
+                return sys.intern(self._checknumber(buf[pos - 1:self._pos], self._numonce))
 
             # Return single keywords
             return token
@@ -131,6 +158,175 @@ class clex(object):
         """
         self._tokenstack.append(token)
 
+    def _prepare(self):
+        """
+        Sets up character lookup tables and regexes from the configuration attributes.
+        Called once, before the first token is read.
+        Tables only depend on configuration, so they are built once per configuration and shared by all lexers using it.
+        Character set attributes may be strings or sequences of characters, so they are joined for the cache key.
+        """
+        key = (
+            ''.join(self.escape),
+            ''.join(self.quotes),
+            ''.join(self.whitespace),
+            tuple(self.oneline_commenters),
+            tuple(tuple(x) for x in self.multiline_commenters),
+            tuple(''.join(x) for x in self.tokenchars),
+            tuple(''.join(x) for x in self.numchars),
+        )
+        tables = _tables.get(key)
+        if tables is None:
+            if len(_tables) >= _MAXTABLES:
+                _tables.clear()
+            tables = _tables[key] = self._build_tables()
+        self.__dict__.update(tables)
+        self._prepared = True
+
+    def _build_tables(self):
+        """
+        Builds character lookup tables and regexes from the configuration attributes.
+        Returns them as a dict of lexer attributes.
+        """
+        # First closer listed for an opener wins
+        multiline_closers = {}
+        for opener, closer in self.multiline_commenters:
+            multiline_closers.setdefault(opener, closer)
+
+        oneline_trie = self._build_trie(self.oneline_commenters)
+        multiline_trie = self._build_trie(multiline_closers)
+
+        idfirst, idmore = [''.join(x) for x in self.tokenchars]
+        numfirst, numonce, numsign = [''.join(x) for x in self.numchars]
+
+        return {
+            '_ws': frozenset(self.whitespace),
+            '_quotes': frozenset(self.quotes),
+            '_eol': frozenset('\r\n'),
+
+            '_idstart': frozenset(idfirst),
+            '_idcont_re': self._build_run_re(idfirst + idmore),
+
+            '_numstart': frozenset(numfirst + numsign),
+            '_numcont_re': self._build_run_re(numfirst + numonce),
+            '_numonce': frozenset(numonce),
+
+            '_oneline_trie': oneline_trie,
+            '_multiline_closers': multiline_closers,
+            '_multiline_trie': multiline_trie,
+            '_commentstart': frozenset(oneline_trie) | frozenset(multiline_trie),
+            # Comments ending in EOF are left for the character by character checks in `read_token`
+            '_skip_re': re.compile('(?:%s)*' % '|'.join(self._skip_patterns(multiline_closers, allow_eof=False)), re.DOTALL),
+        }
+
+    def _charclass(self, chars):
+        """
+        Returns a regex character class matching any of `chars` (nothing if `chars` is empty).
+        """
+        if not len(chars):
+            return '[^\\s\\S]'
+        return '[%s]' % re.escape(''.join(chars))
+
+    def _build_run_re(self, chars):
+        """
+        Builds a regex matching a (possibly empty) run of characters from `chars`.
+        """
+        return re.compile(self._charclass(chars) + '*')
+
+    def _skip_patterns(self, multiline_closers, allow_eof):
+        """
+        Returns regex alternatives (for use with `re.DOTALL`) matching a whitespace run or a comment.
+        Multiline comments are taken from `multiline_closers`, mapping each opener to its closer.
+        Unless `allow_eof` is set, comments ending in EOF are not matched.
+        Alternatives are ordered (and guarded) so a regex picks the same commenter `read_token` would.
+        """
+        skips = []
+        if len(self.whitespace):
+            skips.append('[%s]+' % re.escape(''.join(self.whitespace)))
+
+        # Shortest commenter wins, like with openers below
+        oneline = '|'.join(re.escape(x) for x in sorted(self.oneline_commenters, key=len) if len(x))
+        if oneline:
+            skips.append('(?:%s)[^\n]*\n%s' % (oneline, '?' if allow_eof else ''))
+
+        # Shortest opener wins, so skip openers that a shorter opener is a prefix of
+        openers = []
+        for opener, closer in sorted(multiline_closers.items(), key=lambda x: len(x[0])):
+            if not len(opener):
+                continue
+            guards = [re.escape(x) for x in openers if opener.startswith(x)]
+            if oneline:
+                guards.append(oneline)
+            guard = '(?!%s)' % '|'.join(guards) if guards else ''
+            closer = '(?:%s|\\Z)' % re.escape(closer) if allow_eof else re.escape(closer)
+            skips.append('%s%s.*?%s' % (guard, re.escape(opener), closer))
+            openers.append(opener)
+
+        return skips
+
+    def _build_scanner(self, binary=False):
+        """
+        Builds an `re.Scanner` tokenizing a whole input the same way `read_token` does.
+        If `binary` is set, the scanner works on bytes (configuration is encoded as latin-1) instead of text.
+        Exceptions raised always carry text.
+        Actions don't refer to the lexer, so a cached scanner doesn't keep its input alive.
+        """
+        numonce = self._numonce
+
+        def text(value):
+            return value.decode('latin-1') if binary else value
+
+        def token(scanner, value):
+            return value
+
+        def keyword(scanner, value):
+            return value if binary else sys.intern(value)
+
+        def number(scanner, value):
+            clex._checknumber(text(value), numonce)
+            return keyword(scanner, value)
+
+        def eol(scanner, value):
+            raise UnexpectedEOLError(text(value[-1:]))
+
+        def eof(scanner, value):
+            raise UnexpectedEOFError()
+
+        rules = [(x, None) for x in self._skip_patterns(self._multiline_closers, allow_eof=True)]
+
+        # A quote preceded by an escape character is part of the string, else it closes it
+        escape = self._charclass(self.escape)
+        for quote in self.quotes:
+            body = '%s(?:[^%s\\r\\n]|(?<=%s)%s)*' % ((re.escape(quote),) * 2 + (escape, re.escape(quote)))
+            rules.append(('%s(?<!%s)%s' % (body, escape, re.escape(quote)), token))
+            rules.append(('%s[\\r\\n]' % body, eol))
+        if len(self.quotes):
+            rules.append((self._charclass(self.quotes), eof))
+
+        idfirst, idmore = [''.join(x) for x in self.tokenchars]
+        numfirst, numonce, numsign = [''.join(x) for x in self.numchars]
+        rules.append((self._charclass(idfirst) + self._charclass(idfirst + idmore) + '*', keyword))
+        rules.append((self._charclass(numfirst + numsign) + self._charclass(numfirst + numonce) + '*', number))
+        rules.append(('.', token))
+
+        if binary:
+            rules = [(x.encode('latin-1'), action) for x, action in rules]
+        return re.Scanner(rules, re.DOTALL)
+
+    def _build_trie(self, tokens):
+        """
+        Builds a prefix tree out of `tokens` for use by `_findtokens`.
+        Each node is a dict mapping a character to its child node, nodes ending a token also map `None` to `True`.
+        """
+        trie = {}
+        for token in tokens:
+            if not len(token):
+                continue
+            node = trie
+            for c in token:
+                node = node.setdefault(c, {})
+            node[None] = True
+        return trie
+
     def _log(self, msg):
         """
         Logs a message if debug is on.
@@ -138,109 +334,183 @@ class clex(object):
         if self.debug:
             self.logger(msg)
 
-    def _readone(self, exception=None):
+    def _fill(self, keep):
         """
-        Read one character from input.
-        May possible acquire a character from `_oops` if available.
-        Data member `oops` is used incase characters were read but needs to be pushed back to stream again.
+        Reads another chunk from input stream into the buffer, if lexing in chunks.
+        Buffered input before position `keep` is dropped, so all buffer positions move back by `keep`.
+        Returns False (leaving the buffer as is) if there is no more input.
         """
-        if len(self._oops):
-            one = self._oops.pop(0)
-        else:
-            one = self._instream.read(1)
-            if not len(one) and exception:
-                raise exception
-        return one
-
-    def _findtokens_pass(self, token, tokens):
-        """
-        Finds `token` in `tokens` list.
-        If found, returns `None, True`.
-        If not found, returns `<remaining>, False`.
-        List `remaining` contains all entries from `tokens` that start with the given token.
-        This way, multiple passes can be done until either token was found or no remaining tokens are left.
-        """
-        remaining = tokens[:]
-        for i,w in enumerate(tokens[::-1]):
-            if w == token:
-                return None, True
-            if not w.startswith(token):
-                remaining.pop(len(tokens)-i-1)
-        return remaining, False
-
-    def _findtokens(self, token, tokens):
-        """
-        Finds a token in `tokens`, with initial token `token`.
-        This function will further read from input until either token is finally found, not found or EOF is reached.
+        if self._stream is None:
+            return False
+        data = self._stream.read(self._bufsize)
+        if not len(data):
+            self._stream = None
+            return False
+        self._buf = self._buf[keep:] + data
+        self._pos -= keep
+        self._len = len(self._buf)
+        return True
+
+    def _extendrun(self, start, run_re):
+        """
+        Extends a token from `start` running up to the end of the buffer, with further input matching `run_re`.
+        Returns the whole token.
+        """
+        # Collect the token chunk by chunk, so the buffer never holds more than one chunk of it
+        parts = [self._buf[start:self._pos]]
+        while self._pos >= self._len and self._fill(self._pos):
+            self._pos = run_re.match(self._buf, 0).end()
+            parts.append(self._buf[:self._pos])
+        return ''.join(parts)
+
+    def _findtokens(self, token, trie):
+        """
+        Finds a token in prefix tree `trie` (see `_build_trie`), with initial token `token`, which must be the last character read.
+        This function will look further into input until either token is finally found, not found or EOF is reached.
         Returns the found token or None if not found.
-        If `None` is returned, `_oops` is adjusted accordingly to restore previous stream state.
-        """
-        if not len(tokens):
-            return token, False
-        if isinstance(tokens, str):
-            tokens = [x for x in tokens]
-        tokens, found = self._findtokens_pass(token, tokens)
-        if found:
-            return token
-        if not len(tokens):
+        Input is only consumed past `token` if a token was found, so nothing needs to be pushed back otherwise.
+        """
+        node = trie.get(token)
+        if node is None:
             return None
-        while len(tokens):
-            one = self._readone()
-            if not len(one):
-                self._oops.extend(x for x in token[1:])
-                self._oops.append(one)
+        start = self._pos - 1
+        pos = self._pos
+        while None not in node:
+            if pos >= self._len:
+                if not self._fill(start):
+                    return None
+                pos -= start
+                start = 0
+            node = node.get(self._buf[pos])
+            if node is None:
                 return None
-            token = token + one
-            tokens, found = self._findtokens_pass(token, tokens)
-            if found:
-                return token
-        self._oops.extend(x for x in token[1:])
-        return None
+            pos += 1
+        self._pos = pos
+        return self._buf[start:pos]
 
+    @staticmethod
+    def _checknumber(token, once):
+        """
+        Raises `UnexpectedToken` for the second occurrence of a character from `once` in number `token`.
+        Returns `token` otherwise.
+        """
+        if any(token.count(x) > 1 for x in once):
+            seen = set()
+            for ntoken in token:
+                if ntoken in seen:
+                    raise UnexpectedToken(ntoken)
+                if ntoken in once:
+                    seen.add(ntoken)
+        return token
 
     def _consumeuntil(self, value, allow_eof, allow_eol):
         """
         Consume characters from input until `value` has been consumed (including).
         Switches `allow_eof`, `allow_eol` mandate whether EOF and EOL mid-consumption is legal or not.
-        If EOF is reached and `allow_eof` is True, returns all consumed data so far. Else raises `UnexpectedEOFError`.
+        If EOF is reached and `allow_eof` is True, consumes all remaining input. Else raises `UnexpectedEOFError`.
         If EOL is reached and `allow_eol` is True or EOL is part of `value`, it is consumed like regular input. Else raises `UnexpectedEOLError`.
+        Consumed input is discarded rather than returned, so memory stays bounded when lexing in chunks.
         """
-        token = ''
-        while not token.endswith(value):
-            curr = self._readone()
-            if not len(curr):
-                if allow_eof:
-                    return token
+        start = self._pos
+        end = self._buf.find(value, start)
+        while end < 0:
+            if not allow_eol:
+                self._checkeol(start, self._len, value)
+            # Only keep the tail of the buffer `value` may straddle
+            start = max(self._len - len(value) + 1, start)
+            if not self._fill(start):
+                break
+            start = 0
+            end = self._buf.find(value)
+        stop = end if end >= 0 else self._len
+        if not allow_eol:
+            self._checkeol(start, stop, value)
+        if end < 0:
+            self._pos = self._len
+            if not allow_eof:
                 raise UnexpectedEOFError()
-            if not allow_eol and curr in '\r\n' and curr not in value:
-                raise UnexpectedEOLError(curr)
-            token = token + curr
-        return token
+            return
+        self._pos = end + len(value)
 
     def _consumestring(self, quote):
         """
-        Consumes a string starting with quote character `quote`.
+        Consumes a string starting with quote character `quote`, which must be the last character read.
         Returns the string (including quotes).
         """
-        token = quote
+        buf = self._buf
+        find = buf.find
+        escape = self.escape
+        start = self._pos - 1
+        pos = self._pos
+        parts = []
         while True:
-            curr = self._readone()
-            if not len(curr):
+            # Skip escaped quotes, then check the string so far for EOLs at once
+            end = find(quote, pos)
+            while end >= 0 and buf[end - 1] in escape:
+                end = find(quote, end + 1)
+            self._checkeol(pos, end if end >= 0 else self._len)
+            if end >= 0:
+                break
+            # Collect the string chunk by chunk, keeping only the last character buffered as it may escape a quote
+            keep = self._len - 1
+            parts.append(buf[start:keep])
+            if not self._fill(keep):
+                self._pos = self._len
                 raise UnexpectedEOFError()
-            if curr in '\r\n':
-                raise UnexpectedEOLError(curr)
-            if curr == quote and token[-1] not in self.escape:
-                return token + curr
-            token = token + curr
+            buf = self._buf
+            find = buf.find
+            start = 0
+            pos = 1
+        self._pos = end + 1
+        parts.append(buf[start:self._pos])
+        return ''.join(parts)
+
+    def _checkeol(self, start, stop, value=''):
+        """
+        Raises `UnexpectedEOLError` for the first EOL character (not part of `value`) in input between `start` and `stop`.
+        Input is consumed up to and including that EOL character.
+        """
+        eols = [self._buf.find(x, start, stop) for x in self._eol if x not in value]
+        eols = [x for x in eols if x >= 0]
+        if len(eols):
+            self._pos = min(eols) + 1
+            raise UnexpectedEOLError(self._buf[self._pos - 1])
+
+
+_split_scanner = None
 
 
 def split(instream):
     """
     Split `instream` to a full list of tokens.
+    Tokenizes in a single `re.Scanner` pass, using the default `clex` configuration.
+    """
+    global _split_scanner
+    if _split_scanner is None:
+        cl = clex('')
+        cl._prepare()
+        _split_scanner = cl._build_scanner()
+    tokens, rest = _split_scanner.scan(clex(instream)._buf)
+    if len(rest):
+        raise UnexpectedToken(rest[0])
+    return tokens
+
+
+_split_bytes_scanner = None
+
+
+def split_bytes(buf):
+    """
+    Split bytes-like `buf` to a full list of bytes tokens.
+    Same as `split`, but works on raw bytes and skips decoding entirely.
+    Input must be ASCII-compatible, other bytes outside strings and comments come out as one token each.
     """
-    cl = clex(instream)
-    items = []
-    while not len(items) or items[-1] != cl.eof:
-        items.append(cl.get_token())
-    items.pop()
-    return items
+    global _split_bytes_scanner
+    if _split_bytes_scanner is None:
+        cl = clex('')
+        cl._prepare()
+        _split_bytes_scanner = cl._build_scanner(binary=True)
+    tokens, rest = _split_bytes_scanner.scan(buf)
+    if len(rest):
+        raise UnexpectedToken(rest[:1].decode('latin-1'))
+    return tokens
@@ -13,7 +13,7 @@ setuptools.setup(
         'Source Code': 'https://github.com/yuvalino/python-clex'
     },
 
-    install_requires=['six'],
+    python_requires='>=3',
 
     package_data={'': [
         '*.txt',
@@ -22,6 +22,7 @@ setuptools.setup(
 
     classifiers=[
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
     ],
 
     packages=setuptools.find_packages(),
@@ -0,0 +1,71 @@
+import io
+import unittest
+
+from clex import clex, split, split_bytes
+from clex.clex import UnexpectedEOFError
+
+
+SOURCE = '''
+/* Example */
+#include <stdio.h>
+
+int main(int argc, char **argv)
+{
+    // Greeting
+    const char *s = "hello \\"world\\"\\n";
+    float f = -1.5 + 2.;
+    char c = '\\'';
+    return s[0] == c ? 0 : argc - 1;
+}
+'''
+
+
+class SplitBytesTest(unittest.TestCase):
+    def test_matches_split(self):
+        self.assertEqual(split_bytes(SOURCE.encode()), [x.encode() for x in split(SOURCE)])
+
+    def test_buffer_types(self):
+        for buf in (bytearray(SOURCE.encode()), memoryview(SOURCE.encode())):
+            tokens = split_bytes(buf)
+            self.assertEqual(tokens, split_bytes(SOURCE.encode()))
+            self.assertTrue(all(type(x) is bytes for x in tokens))
+
+    def test_unterminated_string(self):
+        with self.assertRaises(UnexpectedEOFError):
+            split_bytes(b'x = "abc')
+
+
+def tokens(cl):
+    result = []
+    while True:
+        token = cl.get_token()
+        if token == cl.eof:
+            return result
+        result.append(token)
+
+
+class ChunkedTest(unittest.TestCase):
+    def check(self, source):
+        expected = tokens(clex(source))
+        for bufsize in (1, 2, 3):
+            self.assertEqual(tokens(clex(io.StringIO(source), bufsize=bufsize)), expected, bufsize)
+
+    def test_source(self):
+        self.check(SOURCE)
+
+    def test_comments(self):
+        self.check('a /* multi\nline */ b // line\nc /**/ d //\n/* unterminated')
+
+    def test_escaped_quote(self):
+        self.check('x = "a\\"b\\"" + \'\\\'\' + "" ;')
+
+    def test_number(self):
+        self.check('12345.678 -9.5 +1. 3')
+
+    def test_bufsize(self):
+        with self.assertRaises(ValueError):
+            clex(io.StringIO('a'), bufsize=0)
+
+
+if __name__ == '__main__':
+    unittest.main()